@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of implied volatilities and Greeks, stored in SQLite.
+
+Entries are keyed by a hash of everything the results depend on plus the model
+version, so changing the pricing formulas and bumping the version never serves
+stale results.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+
+
+class GreeksCache:
+    def __init__(self, path, modelVersion, maxEntries=1000000, commitEvery=1000):
+
+        self.path = path
+        self.modelVersion = str(modelVersion)
+        self.maxEntries = maxEntries
+        self.commitEvery = commitEvery
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidated = 0
+        self.pendingWrites = 0
+        self.clock = 0
+
+        self.lock = threading.Lock()
+        # The chain pricer runs in its own pipeline thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, modelVersion TEXT, value TEXT, lastUsed INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS resultsLastUsed ON results (lastUsed)"
+        )
+        self.invalidated = self.connection.execute(
+            "DELETE FROM results WHERE modelVersion != ?", (self.modelVersion,)
+        ).rowcount
+        self.connection.commit()
+
+        self.size, clock = self.connection.execute(
+            "SELECT COUNT(*), MAX(lastUsed) FROM results"
+        ).fetchone()
+        self.clock = clock or 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def key(self, *inputs):
+        """
+        Hashes the model version and the pricing inputs into a cache key.
+        Floats are normalised so numpy and Python numbers hash the same.
+        """
+        normalised = [self.modelVersion] + [
+            repr(float(x)) if not isinstance(x, str) else x for x in inputs
+        ]
+
+        return hashlib.sha256("|".join(normalised).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached dict of results for key, or None on a miss.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.clock += 1
+            self.connection.execute(
+                "UPDATE results SET lastUsed = ? WHERE key = ?", (self.clock, key)
+            )
+            self.wrote()
+
+        return json.loads(row[0])
+
+    def put(self, key, values):
+
+        with self.lock:
+            self.clock += 1
+            value = json.dumps(values)
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)",
+                (key, self.modelVersion, value, self.clock),
+            ).rowcount
+            if inserted == 0:
+                self.connection.execute(
+                    "UPDATE results SET value = ?, lastUsed = ? WHERE key = ?",
+                    (value, self.clock, key),
+                )
+            self.size += inserted
+
+            if self.size > self.maxEntries:
+                self.evict()
+
+            self.wrote()
+
+    def evict(self):
+        """
+        Drops the least recently used tenth of the cache once it is over maxEntries.
+        """
+        count = self.size - self.maxEntries + self.maxEntries // 10
+        evicted = self.connection.execute(
+            "DELETE FROM results WHERE key IN "
+            "(SELECT key FROM results ORDER BY lastUsed LIMIT ?)",
+            (count,),
+        ).rowcount
+        self.size -= evicted
+        self.evictions += evicted
+
+    def wrote(self):
+
+        self.pendingWrites += 1
+        if self.pendingWrites >= self.commitEvery:
+            self.connection.commit()
+            self.pendingWrites = 0
+
+    def hitRate(self):
+
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+
+        return self.hits / lookups
+
+    def stats(self):
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hitRate(),
+            "evictions": self.evictions,
+            "invalidated": self.invalidated,
+            "size": self.size,
+        }
+
+    def close(self):
+
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
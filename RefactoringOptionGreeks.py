@@ -5,16 +5,74 @@ Created on Tue Jun  7 13:43:59 2022
 @author: Kyle
 """
 
+import contextlib
+import csv
 import datetime
 import math
 import matplotlib.pyplot
+import numpy
+import os
+import queue
+import threading
 import yfinance
-from scipy.stats import norm
+from OptionCache import GreeksCache
+from OptionNumerics import normCdf, normPdf
 
 matplotlib.pyplot.switch_backend("TkAgg")
 
+# Bump whenever the pricing, implied volatility or Greek formulas change so that
+# results cached under the old formulas are never reused
+MODEL_VERSION = 2
+
+
+def yearFraction(currentDate, currentTime, expiration):
+    """
+    Time from now until the 17:30 expiry, as a fraction of a 365 day year.
+    """
+    hours, minutes = 17, 30
+    years, months, days = [int(time) for time in expiration.split("-")]
+    expirationDatetime = datetime.datetime(years, months, days, hours, minutes)
+
+    hours, minutes = [int(time) for time in currentTime.split(":")]
+    years, months, days = [int(time) for time in currentDate.split("-")]
+    currentDatetime = datetime.datetime(years, months, days, hours, minutes)
+
+    days = 24 * 60 * 60 * (expirationDatetime - currentDatetime).days
+    seconds = (expirationDatetime - currentDatetime).seconds
+
+    actualTimeValue = (days + seconds) / (365 * 24 * 60 * 60)
+
+    return actualTimeValue
+
 
 class StockOption:
+
+    # Cached results are keyed by time to expiry in buckets 0.1% of the remaining
+    # life wide, and contracts with less than a day left are never cached
+    cacheTimeBucket = 0.001
+    cacheMinimumTime = 1 / 365
+
+    cachedFields = [
+        "actualTime",
+        "impliedVolatility",
+        "bidImpliedVolatility",
+        "askImpliedVolatility",
+        "BSMvega",
+        "BSMdelta",
+        "BSMgamma",
+        "BSMtheta",
+        "BSMrho",
+        "BSMlambda",
+        "BSMvanna",
+        "BSMcharm",
+        "BSMvomma",
+        "BSMveta",
+        "BSMspeed",
+        "BSMzomma",
+        "BSMcolor",
+        "BSMultima",
+    ]
+
     def __init__(
         self,
         optionPrice,
@@ -27,7 +85,15 @@ class StockOption:
         bidPrice,
         askPrice,
         interestRate,
+        ivGuess=None,
+        cache=None,
     ):
+        """
+        ivGuess is an optional (bid, mid, ask) implied volatility warm start, e.g.
+        from the neighbouring strike or the previous snapshot of this contract.
+        cache is an optional OptionCache.GreeksCache; on a hit the implied
+        volatilities and Greeks are loaded from it instead of being solved.
+        """
 
         # Fixed Parameters
 
@@ -57,9 +123,63 @@ class StockOption:
         self.dividendRate = 0
         self.bidPrice = bidPrice
         self.askPrice = askPrice
+
+        if cache is not None and self.actualTime < self.cacheMinimumTime:
+            cache = None
+
+        if cache is not None:
+            # A hit restores the actualTime its Greeks were computed from, which is
+            # at most cacheTimeBucket of the remaining life away from this one
+            cacheKey = cache.key(
+                self.optionType,
+                self.sharePrice,
+                self.strikePrice,
+                round(math.log(self.actualTime) / math.log1p(self.cacheTimeBucket)),
+                self.interestRate,
+                self.dividendRate,
+                self.optionPrice,
+                self.bidPrice,
+                self.askPrice,
+            )
+            cached = cache.get(cacheKey)
+            if cached is not None:
+                for name in self.cachedFields:
+                    setattr(self, name, cached[name])
+                return
+
+        if ivGuess is None:
+            ivGuess = (None, None, None)
+        bidGuess, midGuess, askGuess = ivGuess
+
         volatilityParam = self.BlackScholesMertonImpliedVolatility(
-            self.sharePrice, self.actualTime
+            self.sharePrice, self.actualTime, guess=midGuess
         )
+
+        # Price rises with volatility, so the mid solution bounds the bid and ask solves
+        if bidPrice > 0:
+            self.bidImpliedVolatility = self.BlackScholesMertonImpliedVolatility(
+                self.sharePrice,
+                self.actualTime,
+                bidPrice,
+                bidGuess,
+                IV_high_guess=(
+                    volatilityParam[0] if bidPrice <= self.optionPrice else 20
+                ),
+            )[0]
+        else:
+            self.bidImpliedVolatility = math.nan
+
+        if askPrice > 0:
+            self.askImpliedVolatility = self.BlackScholesMertonImpliedVolatility(
+                self.sharePrice,
+                self.actualTime,
+                askPrice,
+                askGuess,
+                IV_low_guess=volatilityParam[0] if askPrice >= self.optionPrice else 0,
+            )[0]
+        else:
+            self.askImpliedVolatility = math.nan
+
         self.impliedVolatility = volatilityParam[0]
         self.BSMvega = volatilityParam[1]
 
@@ -88,6 +208,11 @@ class StockOption:
         self.BSMcolor = self.__color()
         self.BSMultima = self.__ultima()
 
+        if cache is not None:
+            cache.put(
+                cacheKey, {name: getattr(self, name) for name in self.cachedFields}
+            )
+
     def __repr__(self):
         """
         Calling information for each stock option instance
@@ -98,30 +223,17 @@ class StockOption:
         """
         This converts the time into minutes because minutes is what the VIX model uses.
         """
-        hours, minutes = 17, 30
-        years, months, days = [int(time) for time in expiration.split("-")]
-        expirationDatetime = datetime.datetime(years, months, days, hours, minutes)
-
-        hours, minutes = [int(time) for time in currentTime.split(":")]
-        years, months, days = [int(time) for time in currentDate.split("-")]
-        currentDatetime = datetime.datetime(years, months, days, hours, minutes)
-
-        days = 24 * 60 * 60 * (expirationDatetime - currentDatetime).days
-        seconds = (expirationDatetime - currentDatetime).seconds
-
-        actualTimeValue = (days + seconds) / (365 * 24 * 60 * 60)
-
-        return actualTimeValue
+        return yearFraction(currentDate, currentTime, expiration)
 
     def N(self, x):
 
-        NValue = norm.cdf(x)
+        NValue = normCdf(x)
 
         return NValue
 
     def phi(self, x):
 
-        phiValue = norm.pdf(x)
+        phiValue = normPdf(x)
 
         return phiValue
 
@@ -208,13 +320,58 @@ class StockOption:
 
         return round(vegaValue, 4)
 
-    def BlackScholesMertonImpliedVolatility(self, sharePrice, actualTime):
+    def bracketImpliedVolatility(
+        self, sharePrice, actualTime, optionPrice, guess, IV_low_guess, IV_high_guess
+    ):
+        """
+        Narrows [IV_low_guess, IV_high_guess] to a small bracket around a warm start
+        guess, such as the neighbouring strike's solution. The bracket grows outward
+        until the price at its ends straddles optionPrice.
+        """
+        step = 0.02
+        guess = min(max(guess, IV_low_guess), IV_high_guess)
+        low = max(IV_low_guess, guess - step)
+        high = min(IV_high_guess, guess + step)
+
+        while (
+            low > IV_low_guess
+            and self.BlackScholesMertonPrice(sharePrice, actualTime, low) > optionPrice
+        ):
+            high = low
+            step *= 4
+            low = max(IV_low_guess, low - step)
+
+        while (
+            high < IV_high_guess
+            and self.BlackScholesMertonPrice(sharePrice, actualTime, high) < optionPrice
+        ):
+            low = high
+            step *= 4
+            high = min(IV_high_guess, high + step)
+
+        return low, high
+
+    def BlackScholesMertonImpliedVolatility(
+        self,
+        sharePrice,
+        actualTime,
+        optionPrice=None,
+        guess=None,
+        IV_low_guess=0,
+        IV_high_guess=20,
+    ):
+
+        if optionPrice is None:
+            optionPrice = self.optionPrice
+
+        if guess is not None and not math.isnan(guess):
+            IV_low_guess, IV_high_guess = self.bracketImpliedVolatility(
+                sharePrice, actualTime, optionPrice, guess, IV_low_guess, IV_high_guess
+            )
 
-        IV_low_guess = 0
-        IV_high_guess = 20
         IV_middle = (IV_low_guess + IV_high_guess) * 0.5
         priceMiddle = self.BlackScholesMertonPrice(sharePrice, actualTime, IV_middle)
-        eAmount = priceMiddle - self.optionPrice
+        eAmount = priceMiddle - optionPrice
 
         while IV_high_guess - IV_low_guess >= 0.1 / 100:
 
@@ -229,7 +386,7 @@ class StockOption:
             priceMiddle = self.BlackScholesMertonPrice(
                 sharePrice, actualTime, IV_middle
             )
-            eAmount = priceMiddle - self.optionPrice
+            eAmount = priceMiddle - optionPrice
         vega = self.BSMvega(sharePrice, actualTime, IV_middle)
         return IV_middle, vega
 
@@ -533,8 +690,17 @@ def plotCheckandParams():
     while priceType not in ["mid", "last"]:
         priceType = input("Mid or Last Price? [mid or last]")
 
-    optionType = "both"
-    moneynessType = "both"
+    optionType = input("Calls, puts or both? [calls, puts or both]")
+    while optionType not in ["calls", "puts", "both"]:
+        optionType = input("Calls, puts or both? [calls, puts or both]")
+
+    moneynessType = input("ITM, OTM or both? [itm, otm or both]")
+    while moneynessType not in ["itm", "otm", "both"]:
+        moneynessType = input("ITM, OTM or both? [itm, otm or both]")
+
+    exportType = input("Export results? [none, parquet, arrow or csv]")
+    while exportType not in ["none", "parquet", "arrow", "csv"]:
+        exportType = input("Export results? [none, parquet, arrow or csv]")
 
     currentDate, currentTime = handleDateTime()
 
@@ -544,215 +710,760 @@ def plotCheckandParams():
         priceType,
         optionType,
         moneynessType,
+        exportType,
         currentDate,
         currentTime,
     )
 
 
-def returnOptions(
-    currentDate, currentTime, ticker, optionType, priceType, interestRate=0
+def defaultFilters():
+    """
+    Filter settings applied to each raw option chain before any pricing.
+    None disables a bound. Calls and puts are chosen by returnOptions' optionType.
+        moneynessType: "itm", "otm" or "both"
+        minMoneyness, maxMoneyness: bounds on strike / share price
+        minDelta, maxDelta: bounds on absolute delta, estimated from the chain's own
+            impliedVolatility column
+        minBid: smallest bid price kept
+        maxSpread: largest ask - bid kept
+        minOpenInterest, minVolume: liquidity floors
+        maxExpiry: expirations further than this many days out are not fetched
+    Contracts with no usable option price are always dropped.
+    """
+    return {
+        "moneynessType": "both",
+        "minMoneyness": None,
+        "maxMoneyness": None,
+        "minDelta": None,
+        "maxDelta": None,
+        "minBid": None,
+        "maxSpread": None,
+        "minOpenInterest": None,
+        "minVolume": None,
+        "maxExpiry": None,
+    }
+
+
+def filterExpirations(expirations, currentDate, filters):
+    """
+    Drops expirations past filters["maxExpiry"] days so they are never fetched.
+    """
+    if filters["maxExpiry"] is None:
+        return list(expirations)
+
+    today = datetime.date.fromisoformat(currentDate)
+
+    return [
+        expiration
+        for expiration in expirations
+        if (datetime.date.fromisoformat(expiration) - today).days
+        <= filters["maxExpiry"]
+    ]
+
+
+def filterChain(
+    optionChain, optionType, sharePrice, actualTime, priceType, filters, interestRate=0
 ):
+    """
+    Vectorized filter over a raw yfinance chain.
+    Returns the kept rows, with an added optionPrice column, and a count of the
+    dropped rows keyed by the first filter each one failed.
+    """
+    optionChain = optionChain.fillna(0)
+    bid = optionChain["bid"].to_numpy(dtype=float)
+    ask = optionChain["ask"].to_numpy(dtype=float)
+    strike = optionChain["strike"].to_numpy(dtype=float)
+
+    if priceType == "mid":
+        optionPrice = numpy.round((bid + ask) / 2, 2)
+    elif priceType == "last":
+        optionPrice = optionChain["lastPrice"].to_numpy(dtype=float)
+
+    if optionType == "optioncall":
+        itm = strike <= sharePrice
+    elif optionType == "optionput":
+        itm = strike > sharePrice
+
+    checks = [("noPrice", optionPrice > 0)]
+
+    if filters["moneynessType"] == "itm":
+        checks.append(("moneynessType", itm))
+    elif filters["moneynessType"] == "otm":
+        checks.append(("moneynessType", ~itm))
+
+    moneyness = strike / sharePrice
+    if filters["minMoneyness"] is not None:
+        checks.append(("minMoneyness", moneyness >= filters["minMoneyness"]))
+    if filters["maxMoneyness"] is not None:
+        checks.append(("maxMoneyness", moneyness <= filters["maxMoneyness"]))
+
+    if filters["minDelta"] is not None or filters["maxDelta"] is not None:
+        volatility = optionChain["impliedVolatility"].to_numpy(dtype=float)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            d1 = (
+                numpy.log(sharePrice / strike)
+                + (interestRate + 0.5 * volatility**2) * actualTime
+            ) / (volatility * math.sqrt(actualTime))
+        delta = normCdf(d1)
+        if optionType == "optionput":
+            delta = 1 - delta
+        if filters["minDelta"] is not None:
+            checks.append(("minDelta", delta >= filters["minDelta"]))
+        if filters["maxDelta"] is not None:
+            checks.append(("maxDelta", delta <= filters["maxDelta"]))
+
+    if filters["minBid"] is not None:
+        checks.append(("minBid", bid >= filters["minBid"]))
+    if filters["maxSpread"] is not None:
+        checks.append(("maxSpread", ask - bid <= filters["maxSpread"]))
+    if filters["minOpenInterest"] is not None:
+        checks.append(
+            (
+                "minOpenInterest",
+                optionChain["openInterest"].to_numpy(dtype=float)
+                >= filters["minOpenInterest"],
+            )
+        )
+    if filters["minVolume"] is not None:
+        checks.append(
+            (
+                "minVolume",
+                optionChain["volume"].to_numpy(dtype=float) >= filters["minVolume"],
+            )
+        )
 
-    ticker = yfinance.Ticker(ticker)
+    keep = numpy.ones(len(optionChain), dtype=bool)
+    dropped = {}
 
-    sharePrice = ticker.info["regularMarketPrice"]
+    for reason, passed in checks:
+        failed = keep & ~passed
+        if failed.any():
+            dropped[reason] = int(failed.sum())
+        keep &= passed
+
+    optionChain = optionChain.assign(optionPrice=optionPrice)
+
+    return optionChain[keep], dropped
+
+
+def priceChain(
+    optionChain,
+    optionType,
+    sharePrice,
+    expiration,
+    currentTime,
+    currentDate,
+    interestRate,
+    snapshots=None,
+    cache=None,
+):
+    """
+    Builds a StockOption for every row of a filtered chain.
+    Each implied volatility solve is warm started from this contract's entry in
+    snapshots, when given, or else from the previous strike's solution.
+    snapshots is updated in place so it can be passed again on the next refresh.
+    Contracts found in cache skip the solves and Greeks entirely.
+    """
+    singleChain = []
+    ivGuess = None
+
+    idx = 0
+    while idx < len(optionChain):
+        strikePrice = optionChain["strike"].iloc[idx]
+        contract = (optionType, expiration, strikePrice)
+
+        if snapshots is not None and contract in snapshots:
+            ivGuess = snapshots[contract]
+
+        individualOption = StockOption(
+            optionChain["optionPrice"].iloc[idx],
+            sharePrice,
+            strikePrice,
+            expiration,
+            optionType,
+            currentTime,
+            currentDate,
+            optionChain["bid"].iloc[idx],
+            optionChain["ask"].iloc[idx],
+            interestRate,
+            ivGuess,
+            cache,
+        )
+        singleChain.append(individualOption)
 
-    expirations = ticker.options
+        ivGuess = (
+            individualOption.bidImpliedVolatility,
+            individualOption.impliedVolatility,
+            individualOption.askImpliedVolatility,
+        )
+        if snapshots is not None:
+            snapshots[contract] = ivGuess
+
+        idx += 1
+
+    return singleChain
+
+
+def reportDropped(dropped, total, label):
+
+    if len(dropped) == 0:
+        return
 
-    optionCallObjects = {}
+    reasons = ", ".join(
+        "{}={}".format(reason, count) for reason, count in dropped.items()
+    )
+    print(
+        "Dropped {} of {} {} contracts ({})".format(
+            sum(dropped.values()), total, label, reasons
+        )
+    )
 
-    optionPutObjects = {}
+
+def runStage(items, queueSize=2):
+    """
+    Runs a generator stage in a background thread and hands its results on
+    through a bounded queue, so a fast stage blocks until the next one catches up.
+    Errors raised in the stage are re-raised in the consumer.
+    """
+    results = queue.Queue(maxsize=queueSize)
+    stop = threading.Event()
+    finished = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                results.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except Exception as error:
+            put((finished, error))
+            return
+        put((finished, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item, error = results.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def chainTypes(optionType):
+    """
+    (StockOption type, yfinance chain attribute, StockOptions key, name suffix)
+    for each side of the chain selected by optionType.
+    """
+    optionTypes = []
+    if optionType in ["calls", "both"]:
+        optionTypes.append(("optioncall", "calls", "callOptions", "C"))
+    if optionType in ["puts", "both"]:
+        optionTypes.append(("optionput", "puts", "putOptions", "P"))
+
+    return optionTypes
+
+
+def fetchStage(ticker, expirations):
 
     for expiration in expirations:
 
         print("Getting Option Data for expiration of {}".format(expiration))
 
-        optionChain = ticker.option_chain(expiration)
-
-        optionCalls = optionChain.calls.fillna(0)
-        optionPuts = optionChain.puts.fillna(0)
-
-        singleCallChain = []
-        singlePutChain = []
-
-        idx = 0
-        while idx < len(optionCalls):
-            bidPrice = optionCalls["bid"].iloc[idx]
-            askPrice = optionCalls["ask"].iloc[idx]
-            lastPrice = optionCalls["lastPrice"].iloc[idx]
-            strikePrice = optionCalls["strike"].iloc[idx]
-
-            if priceType == "mid":
-                optionPrice = round((bidPrice + askPrice) / 2, 2)
-            elif priceType == "last":
-                optionPrice = lastPrice
-
-            singleCallChain.append(
-                StockOption(
-                    optionPrice,
-                    sharePrice,
-                    strikePrice,
-                    expiration,
-                    "optioncall",
-                    currentTime,
-                    currentDate,
-                    bidPrice,
-                    askPrice,
-                    interestRate,
-                )
-            )
-            idx += 1
-
-        idx = 0
-        while idx < len(optionPuts):
-            bidPrice = optionPuts["bid"].iloc[idx]
-            askPrice = optionPuts["ask"].iloc[idx]
-            lastPrice = optionPuts["lastPrice"].iloc[idx]
-            strikePrice = optionPuts["strike"].iloc[idx]
-
-            if priceType == "mid":
-                optionPrice = round((bidPrice + askPrice) / 2, 2)
-            elif priceType == "last":
-                optionPrice = lastPrice
-
-            singlePutChain.append(
-                StockOption(
-                    optionPrice,
-                    sharePrice,
-                    strikePrice,
-                    expiration,
-                    "optionput",
-                    currentTime,
-                    currentDate,
-                    bidPrice,
-                    askPrice,
-                    interestRate,
-                )
+        yield expiration, ticker.option_chain(expiration)
+
+
+def filterStage(
+    fetched,
+    optionTypes,
+    sharePrice,
+    currentDate,
+    currentTime,
+    priceType,
+    filters,
+    interestRate,
+):
+
+    totalDropped = {}
+    total = 0
+
+    for expiration, optionChain in fetched:
+
+        actualTime = yearFraction(currentDate, currentTime, expiration)
+
+        for stockOptionType, chainName, key, suffix in optionTypes:
+            rawChain = getattr(optionChain, chainName)
+            singleChain = "{} {}".format(expiration, suffix)
+
+            filteredChain, dropped = filterChain(
+                rawChain,
+                stockOptionType,
+                sharePrice,
+                actualTime,
+                priceType,
+                filters,
+                interestRate,
             )
-            idx += 1
+            reportDropped(dropped, len(rawChain), singleChain)
 
-        optionCallObjects["{} C".format(expiration)] = singleCallChain
+            total += len(rawChain)
+            for reason, count in dropped.items():
+                totalDropped[reason] = totalDropped.get(reason, 0) + count
 
-        optionPutObjects["{} P".format(expiration)] = singlePutChain
+            yield expiration, stockOptionType, key, singleChain, filteredChain
 
-    return {"callOptions": optionCallObjects, "putOptions": optionPutObjects}
+    reportDropped(totalDropped, total, "total")
 
 
-def plotOptions(StockOptions, parameters, ticker, currentDate, currentTime):
+def priceStage(
+    filtered,
+    sharePrice,
+    currentDate,
+    currentTime,
+    interestRate,
+    snapshots=None,
+    cache=None,
+):
 
-    faceColor = "white"
-    figure1 = matplotlib.pyplot.figure()
+    for expiration, stockOptionType, key, singleChain, filteredChain in filtered:
+        yield key, singleChain, priceChain(
+            filteredChain,
+            stockOptionType,
+            sharePrice,
+            expiration,
+            currentTime,
+            currentDate,
+            interestRate,
+            snapshots,
+            cache,
+        )
 
-    titles = [x for x in parameters]
 
-    optionTypes = list(StockOptions.keys())
+def streamOptions(
+    currentDate,
+    currentTime,
+    ticker,
+    optionType,
+    priceType,
+    interestRate=0,
+    filters=None,
+    queueSize=2,
+    snapshots=None,
+    cache=None,
+):
+    """
+    Fetches, filters and prices each expiration as overlapping stages and yields
+    (StockOptions key, chain name, list of StockOption) as soon as a chain is priced.
+    At most queueSize chains wait between any two stages.
+    Passing the same snapshots dict on every refresh warm starts the IV solves
+    from the previous run.
+    """
+    if filters is None:
+        filters = defaultFilters()
 
-    firstIteration = True
+    ticker = yfinance.Ticker(ticker)
 
-    expirations = []
+    sharePrice = ticker.info["regularMarketPrice"]
+
+    expirations = filterExpirations(ticker.options, currentDate, filters)
+
+    fetched = runStage(fetchStage(ticker, expirations), queueSize)
+    filtered = runStage(
+        filterStage(
+            fetched,
+            chainTypes(optionType),
+            sharePrice,
+            currentDate,
+            currentTime,
+            priceType,
+            filters,
+            interestRate,
+        ),
+        queueSize,
+    )
 
-    a = 1
+    yield from runStage(
+        priceStage(
+            filtered,
+            sharePrice,
+            currentDate,
+            currentTime,
+            interestRate,
+            snapshots,
+            cache,
+        ),
+        queueSize,
+    )
 
-    mainTitle = []
 
-    for optionType in optionTypes:
-        if optionType == "callOptions":
-            itmColor = "black"
-            otmColor = "yellow"
-            mainTitle.append(
-                "\nITM callOptions={}, OTM callOptions={}".format(itmColor, otmColor)
+def returnOptions(
+    currentDate,
+    currentTime,
+    ticker,
+    optionType,
+    priceType,
+    interestRate=0,
+    filters=None,
+    cache=None,
+):
+
+    StockOptions = {key: {} for _, _, key, _ in chainTypes(optionType)}
+
+    for key, singleChain, options in streamOptions(
+        currentDate,
+        currentTime,
+        ticker,
+        optionType,
+        priceType,
+        interestRate,
+        filters,
+        cache=cache,
+    ):
+        StockOptions[key][singleChain] = options
+
+    return StockOptions
+
+
+class OptionPlotter:
+    """
+    One 3d subplot per parameter, with strike on x, expiration on y and the
+    parameter on z. Chains can be added one at a time as they are priced.
+    """
+
+    colors = {
+        "callOptions": ("black", "yellow"),
+        "putOptions": ("green", "red"),
+    }
+
+    def __init__(self, parameters, ticker, currentDate, currentTime, live=False):
+
+        faceColor = "white"
+
+        self.parameters = parameters
+        self.ticker = ticker
+        self.currentDate = currentDate
+        self.currentTime = currentTime
+        self.live = live
+
+        self.sharePrice = None
+        self.expirations = []
+        self.optionTypes = []
+
+        if live:
+            matplotlib.pyplot.ion()
+
+        self.figure = matplotlib.pyplot.figure()
+        self.figure.set_facecolor(faceColor)
+
+        self.subplots = []
+        for idx, title in enumerate(parameters, start=1):
+            subplot = self.figure.add_subplot(4, 4, idx, projection="3d")
+            subplot.set_title(title)
+            subplot.set_xlabel("strike")
+            subplot.view_init(0, 90)
+            self.subplots.append(subplot)
+
+    def addChain(self, optionType, singleChain, individualStrikes):
+
+        itmColor, otmColor = self.colors[optionType]
+
+        if optionType not in self.optionTypes:
+            self.optionTypes.append(optionType)
+
+        expiration = singleChain.split(" ")[0]  # Splits after first space
+        if expiration not in self.expirations:
+            self.expirations.append(expiration)
+        b = self.expirations.index(expiration)
+
+        for subplot, parameter in zip(self.subplots, self.parameters):
+            tITM = []
+            gITM = []
+            bITM = []
+
+            tOTM = []
+            gOTM = []
+            bOTM = []
+
+            for individualOption in individualStrikes:
+                self.sharePrice = individualOption.sharePrice
+
+                if individualOption.itm:
+                    tITM.append(individualOption.strikePrice)
+                    gITM.append(b)
+                    bITM.append(getattr(individualOption, parameter))
+                else:
+                    tOTM.append(individualOption.strikePrice)
+                    gOTM.append(b)
+                    bOTM.append(getattr(individualOption, parameter))
+
+            subplot.plot(tITM, gITM, bITM, itmColor)
+            subplot.plot(tOTM, gOTM, bOTM, otmColor)
+
+            if parameter == "impliedVolatility":
+                self.plotBand(subplot, individualStrikes, b, itmColor, otmColor)
+
+        if self.live:
+            self.refresh()
+            matplotlib.pyplot.pause(0.001)
+
+    def plotBand(self, subplot, individualStrikes, b, itmColor, otmColor):
+        """
+        Draws the bid and ask implied volatilities as dotted lines either side of
+        the impliedVolatility line.
+        """
+        for itm, color in [(True, itmColor), (False, otmColor)]:
+            options = [x for x in individualStrikes if x.itm == itm]
+            strikes = [x.strikePrice for x in options]
+            expirations = [b] * len(options)
+
+            for bound in ["bidImpliedVolatility", "askImpliedVolatility"]:
+                subplot.plot(
+                    strikes,
+                    expirations,
+                    [getattr(x, bound) for x in options],
+                    color=color,
+                    linestyle=":",
+                )
+
+    def refresh(self):
+
+        b = len(self.expirations)
+
+        if b <= 13:
+            marks = [x for x in range(b)]
+            expirations = self.expirations
+        else:
+            marks = [x for x in range(1, b, 2)]
+            expirations = [self.expirations[x] for x in marks]
+
+        for subplot in self.subplots:
+            subplot.yaxis.set_ticks(marks)
+            subplot.yaxis.set_ticklabels(
+                expirations,
+                fontsize=10,
+                verticalalignment="baseline",
+                horizontalalignment="center",
             )
 
-        elif optionType == "putOptions":
-            itmColor = "green"
-            otmColor = "red"
+        mainTitle = [
+            "{}: ${} @ [{} | {}]".format(
+                self.ticker, self.sharePrice, self.currentDate, self.currentTime
+            )
+        ]
+        for optionType in self.optionTypes:
+            itmColor, otmColor = self.colors[optionType]
             mainTitle.append(
-                "\nITM putOptions={}, OTM putOptions={}".format(itmColor, otmColor)
+                "\nITM {}={}, OTM {}={}".format(
+                    optionType, itmColor, optionType, otmColor
+                )
             )
+        self.figure.suptitle("".join(mainTitle))
 
-        allExpirationsOptions = StockOptions[optionType]
+    def show(self):
 
-        allChains = list(allExpirationsOptions.keys())
+        self.refresh()
+        if self.live:
+            matplotlib.pyplot.ioff()
+        matplotlib.pyplot.show(block=True)
 
-        b = 0
 
-        for singleChain in allChains:  # Adds all Option Expirations to a list
+def plotOptions(StockOptions, parameters, ticker, currentDate, currentTime):
 
-            if a == 1:
-                expiration = singleChain.split(" ")[0]  # Splits after first space
-                expirations.append(expiration)
+    plotter = OptionPlotter(parameters, ticker, currentDate, currentTime)
 
-            individualStrikes = allExpirationsOptions[singleChain]
+    for optionType in StockOptions:
+        allExpirationsOptions = StockOptions[optionType]
+        for singleChain in allExpirationsOptions:
+            plotter.addChain(
+                optionType, singleChain, allExpirationsOptions[singleChain]
+            )
 
-            idx = 2
+    plotter.show()
+
+
+class ChainExporter:
+    """
+    Streams priced option chains to disk one expiration at a time so that
+    memory stays bounded by the largest single chain.
+    Supported formats are "parquet", "arrow" (Arrow IPC file) and "csv".
+    """
+
+    # Types are the names of pyarrow's type factories, e.g. pyarrow.bool_()
+    fields = [
+        ("ticker", "string"),
+        ("expiration", "string"),
+        ("optionType", "string"),
+        ("itm", "bool_"),
+        ("strikePrice", "float64"),
+        ("sharePrice", "float64"),
+        ("optionPrice", "float64"),
+        ("bidPrice", "float64"),
+        ("askPrice", "float64"),
+        ("actualTime", "float64"),
+        ("impliedVolatility", "float64"),
+        ("bidImpliedVolatility", "float64"),
+        ("askImpliedVolatility", "float64"),
+        ("BSMvega", "float64"),
+        ("BSMdelta", "float64"),
+        ("BSMgamma", "float64"),
+        ("BSMtheta", "float64"),
+        ("BSMlambda", "float64"),
+        ("BSMrho", "float64"),
+        ("BSMcharm", "float64"),
+        ("BSMveta", "float64"),
+        ("BSMcolor", "float64"),
+        ("BSMspeed", "float64"),
+        ("BSMvanna", "float64"),
+        ("BSMvomma", "float64"),
+        ("BSMzomma", "float64"),
+        ("BSMultima", "float64"),
+    ]
 
-            for parameter in parameters:
-                tITM = []
-                gITM = []
-                bITM = []
+    def __init__(self, path, fileFormat="parquet"):
 
-                tOTM = []
-                gOTM = []
-                bOTM = []
-                if firstIteration == True:
-                    exec(
-                        "subplot{} = figure1.add_subplot({},{},{}, projection = '3d')".format(
-                            idx - 1, 4, 4, idx - 1
-                        )
-                    )
-                    eval("subplot{}.set_title(titles[{}])".format(idx - 1, idx - 2))
-                    eval("subplot{}.set_xlabel('strike')".format(idx - 1))
-                    eval("subplot{}.view_init(0, 90)".format(idx - 1))
+        self.path = path
+        self.fileFormat = fileFormat.lower()
+        self.rowCount = 0
+        self.writer = None
 
-                for individualOption in individualStrikes:
-                    sharePrice = individualOption.sharePrice
-                    if individualOption.itm:
-                        itm = True
-                    else:
-                        itm = False
+        if self.fileFormat == "csv":
+            self.file = open(path, "w", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow([name for name, _ in self.fields])
 
-                    if itm == True:
-                        tITM.append(individualOption.strikePrice)
-                        gITM.append(b)
-                        eval("bITM.append(individualOption.{})".format(parameter))
-                    elif itm == False:
-                        tOTM.append(individualOption.strikePrice)
-                        gOTM.append(b)
-                        eval("bOTM.append(individualOption.{})".format(parameter))
+        elif self.fileFormat in ["parquet", "arrow"]:
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError(
+                    "{} export requires pyarrow. Use 'pip install pyarrow' or export to csv.".format(
+                        self.fileFormat
+                    )
+                )
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema(
+                [
+                    (name, getattr(pyarrow, fieldType)())
+                    for name, fieldType in self.fields
+                ]
+            )
+            if self.fileFormat == "parquet":
+                import pyarrow.parquet
 
-                eval("subplot{}.plot(tITM, gITM, bITM, '{}')".format(idx - 1, itmColor))
-                eval("subplot{}.plot(tOTM, gOTM, bOTM, '{}')".format(idx - 1, otmColor))
+                self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            else:
+                import pyarrow.ipc
 
-                idx += 1
+                self.file = pyarrow.OSFile(path, "wb")
+                self.writer = pyarrow.ipc.new_file(self.file, self.schema)
 
-            firstIteration = False
+        else:
+            raise ValueError(
+                "Unknown export format {}. Use parquet, arrow or csv.".format(
+                    fileFormat
+                )
+            )
 
-            b += 1
+    def __enter__(self):
+        return self
 
-        a += 1
+    def __exit__(self, *exc):
+        self.close()
 
-    if b <= 13:
-        marks = [x for x in range(b)]
-    else:
-        marks = [x for x in range(1, b, 2)]
-        expirations = [expirations[x] for x in marks]
+    def columns(self, ticker, options):
+        """
+        Lays a chain of StockOption instances out column by column, one list per
+        field, so each column is converted to an Arrow array in a single call.
+        """
+        columns = {"ticker": [ticker] * len(options)}
 
-    subplots = [x for x in range(1, idx - 1)]
+        for name, _ in self.fields[1:]:
+            columns[name] = [getattr(option, name) for option in options]
 
-    for subplot in subplots:
-        eval("subplot{}.yaxis.set_ticks(marks)".format(subplot))
-        eval(
-            "subplot{}.yaxis.set_ticklabels(expirations, fontsize = 10, verticalalignment= 'baseline', horizontalalignment= 'center')".format(
-                subplot
-            )
-        )
+        return columns
 
-    mainTitle.insert(
-        0, "{}: ${} @ [{} | {}]".format(ticker, sharePrice, currentDate, currentTime)
-    )
-    figure1.suptitle("".join(mainTitle))
-    figure1.set_facecolor(faceColor)
-    matplotlib.pyplot.show(block=True)
+    def writeChain(self, ticker, options):
+        """
+        Writes a single expiration's chain as one batch.
+        """
+        if len(options) == 0:
+            return
+
+        columns = self.columns(ticker, options)
+
+        if self.fileFormat == "csv":
+            self.writer.writerows(zip(*[columns[name] for name, _ in self.fields]))
+        else:
+            batch = self.pyarrow.RecordBatch.from_arrays(
+                [
+                    self.pyarrow.array(columns[field.name], type=field.type)
+                    for field in self.schema
+                ],
+                schema=self.schema,
+            )
+            if self.fileFormat == "parquet":
+                self.writer.write_batch(batch)
+            else:
+                self.writer.write(batch)
+
+        self.rowCount += len(options)
+
+    def close(self):
+        if self.writer is None:
+            return
+
+        if self.fileFormat == "parquet":
+            self.writer.close()
+        elif self.fileFormat == "arrow":
+            self.writer.close()
+            self.file.close()
+        elif self.fileFormat == "csv":
+            self.file.close()
+
+        self.writer = None
+
+
+def exportTickers(
+    tickers,
+    path,
+    currentDate,
+    currentTime,
+    priceType,
+    fileFormat="parquet",
+    filters=None,
+    cache=None,
+):
+    """
+    Prices and exports the option chains of several tickers into one file.
+    """
+    with ChainExporter(path, fileFormat) as exporter:
+        for ticker in tickers:
+            for _, _, options in streamOptions(
+                currentDate,
+                currentTime,
+                ticker,
+                "both",
+                priceType,
+                filters=filters,
+                cache=cache,
+            ):
+                exporter.writeChain(ticker, options)
+
+    print("Exported {} contracts to {}".format(exporter.rowCount, path))
+
+    return exporter.rowCount
 
 
 def main():
@@ -762,13 +1473,56 @@ def main():
         priceType,
         optionType,
         moneynessType,
+        exportType,
         currentDate,
         currentTime,
     ) = plotCheckandParams()
-    StockOptions = returnOptions(
-        currentDate, currentTime, ticker, optionType, priceType
-    )
-    plotOptions(StockOptions, parameters, ticker, currentDate, currentTime)
+    filters = defaultFilters()
+    filters["moneynessType"] = moneynessType
+
+    plotter = OptionPlotter(parameters, ticker, currentDate, currentTime, live=True)
+    exporter = None
+
+    # Closes the cache and the exporter even if a chain fails, so an export file
+    # is never left without its footer
+    with contextlib.ExitStack() as stack:
+        cache = stack.enter_context(
+            GreeksCache(
+                os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)),
+                    "OptionGreeksCache.sqlite",
+                ),
+                MODEL_VERSION,
+            )
+        )
+        if exportType != "none":
+            path = "{}_{}.{}".format(ticker, currentDate, exportType)
+            exporter = stack.enter_context(ChainExporter(path, exportType))
+
+        for key, singleChain, options in streamOptions(
+            currentDate,
+            currentTime,
+            ticker,
+            optionType,
+            priceType,
+            filters=filters,
+            cache=cache,
+        ):
+            plotter.addChain(key, singleChain, options)
+            if exporter is not None:
+                exporter.writeChain(ticker, options)
+
+        print(
+            "Cache: {hits} hits, {misses} misses, {hitRate:.1%} hit rate, "
+            "{size} entries, {evictions} evicted, {invalidated} invalidated".format(
+                **cache.stats()
+            )
+        )
+
+    if exporter is not None:
+        print("Exported {} contracts to {}".format(exporter.rowCount, path))
+
+    plotter.show()
 
 
 if __name__ == "__main__":